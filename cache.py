@@ -0,0 +1,89 @@
+"""
+Cache Helper Functions
+
+Cache-aside helpers for read-heavy endpoints. Values are stored as
+pre-serialized JSON so a cache hit can be returned without re-encoding.
+With REDIS_URL set the cache is shared through Redis. Without it, caching
+is off unless LOCAL_CACHE=1 opts into a small process-local TTL cache for the
+item and vendor lists; its invalidations only reach the worker that handled
+the write, so it is meant for single-worker deployments.
+"""
+
+import os
+from typing import Optional
+
+import redis
+import redis.asyncio
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Bump the version to invalidate every key after a response shape change
+KEY_PREFIX = "erp:v2:"
+STOCK_KEY = KEY_PREFIX + "stock:all"
+STOCK_LOW_KEY = KEY_PREFIX + "stock:with-low"
+# First page of /items at the default page size
+ITEMS_KEY = KEY_PREFIX + "items:first"
+VENDORS_KEY = KEY_PREFIX + "vendors:first"
+DEFAULT_TTL = 60
+# Seconds; a slow cache is treated as a miss rather than waited on
+REDIS_TIMEOUT = 0.25
+# Shorter, as other workers' local copies are not invalidated on writes
+LOCAL_TTL = 30
+# Stock changes with every purchase and sale, so it is only cached in Redis
+LOCAL_KEYS = {ITEMS_KEY, VENDORS_KEY}
+
+rds = None
+# Only touched from the event loop thread, so no lock is needed
+_local = None
+
+redis_url = os.getenv("REDIS_URL")
+
+if redis_url:
+    # Short timeouts keep a hung Redis from stalling reads and writes
+    rds = redis.asyncio.Redis.from_url(
+        redis_url,
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT,
+    )
+elif os.getenv("LOCAL_CACHE") == "1":
+    _local = TTLCache(maxsize=64, ttl=LOCAL_TTL)
+
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Return the cached value, or None on a miss or if Redis is unavailable"""
+    if rds is None:
+        if _local is None or key not in LOCAL_KEYS:
+            return None
+        return _local.get(key)
+    try:
+        return await rds.get(key)
+    except redis.RedisError:
+        return None
+
+
+async def cache_set(key: str, value: bytes, ttl: int = DEFAULT_TTL):
+    """Store a value with an expiry (LOCAL_TTL for the process-local cache)"""
+    if rds is None:
+        if _local is not None and key in LOCAL_KEYS:
+            _local[key] = value
+        return
+    try:
+        await rds.set(key, value, ex=ttl)
+    except redis.RedisError:
+        pass
+
+
+async def cache_delete(*keys: str):
+    """Invalidate keys after a write"""
+    if rds is None:
+        if _local is not None:
+            for key in keys:
+                _local.pop(key, None)
+        return
+    try:
+        await rds.delete(*keys)
+    except redis.RedisError:
+        pass
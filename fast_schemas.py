@@ -0,0 +1,43 @@
+"""
+msgspec mirrors of the ERP schemas for bulk endpoints
+
+msgspec decodes and validates a JSON body in a single pass, which keeps large
+imports from being dominated by per-object Pydantic validation. Field names,
+defaults and constraints match the corresponding models in schemas.py.
+Decode with strict=False so numeric strings coerce as they do in Pydantic;
+datetimes are stricter than Pydantic and must be full RFC 3339 timestamps
+(a date-only "2024-05-01" is rejected).
+"""
+
+from datetime import datetime
+from typing import Annotated, List, Optional
+
+import msgspec
+
+NonNegative = Annotated[float, msgspec.Meta(ge=0)]
+Positive = Annotated[float, msgspec.Meta(gt=0)]
+Percent = Annotated[float, msgspec.Meta(ge=0, le=100)]
+
+
+class SaleItemFast(msgspec.Struct, kw_only=True):
+    item_id: str
+    qty: Positive
+    price: NonNegative
+    discount: NonNegative = 0.0
+    tax_rate: Percent = 0.0
+
+
+MAX_BULK_SALES = 500
+
+
+class SaleFast(msgspec.Struct, kw_only=True):
+    customer_id: Optional[str] = None
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[datetime] = None
+    items: List[SaleItemFast]
+    other_charges: float = 0.0
+    notes: Optional[str] = None
+    payment_status: str = "unpaid"
+
+
+SaleBatch = Annotated[List[SaleFast], msgspec.Meta(max_length=MAX_BULK_SALES)]
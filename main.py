@@ -1,16 +1,48 @@
+import asyncio
+import logging
 import os
+import re
+import secrets
+import time
 from datetime import datetime
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException
+import msgspec
+import orjson
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-from database import db, create_document, get_documents
-from schemas import Item, Vendor, Customer, Purchase, Sale, Payment, StockMovement
+from database import db, create_document, create_documents, get_documents_page
+from cache import STOCK_KEY, STOCK_LOW_KEY, ITEMS_KEY, VENDORS_KEY, cache_get, cache_set, cache_delete
+from schemas import Item, Vendor, Customer, Purchase, Sale, Payment
+from fast_schemas import SaleBatch
 
-app = FastAPI(title="Hardware Shop ERP API")
+
+def _json_default(obj):
+    # orjson handles datetime natively; Mongo ids are the only other type we emit,
+    # including the ObjectIds returned by create_document(s)
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that also understands ObjectId.
+
+    Returning this directly from an endpoint skips FastAPI's jsonable_encoder.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Hardware Shop ERP API", default_response_class=MongoJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,166 +58,363 @@ class IdModel(BaseModel):
     id: str
 
 
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}").fullmatch
+
+
 def to_oid(id_str: str) -> ObjectId:
-    try:
-        return ObjectId(id_str)
-    except Exception:
+    if not _OID_RE(id_str):
         raise HTTPException(status_code=400, detail="Invalid id")
+    return ObjectId(id_str)
 
 
 def coll(name: str):
     return db[name]
 
 
+def movement_docs(lines, mv_type: str, ref_type: str, ref_id) -> List[dict]:
+    # Stock movements are written as dict literals rather than StockMovement
+    # models: the lines were already validated with their parent document
+    now = datetime.utcnow()
+    return [
+        {
+            "item_id": line.item_id,
+            "type": mv_type,
+            "qty": line.qty,
+            "reason": ref_type,
+            "ref_type": ref_type,
+            "ref_id": ref_id,
+            "date": now,
+        }
+        for line in lines
+    ]
+
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+async def list_page(name: str, limit: int, after: Optional[str]) -> dict:
+    # Keyset pagination on _id: each page is an index range scan from `after`
+    docs = await get_documents_page(name, limit, to_oid(after) if after else None)
+    next_after = str(docs[-1]["_id"]) if len(docs) == limit else None
+    return {"items": docs, "next": next_after}
+
+
+async def cached_list_page(name: str, key: str, limit: int, after: Optional[str]):
+    # Only the default first page is cached
+    cacheable = after is None and limit == PAGE_SIZE
+    if cacheable:
+        cached = await cache_get(key)
+        if cached:
+            return Response(cached, media_type="application/json")
+    response = MongoJSONResponse(await list_page(name, limit, after))
+    if cacheable:
+        await cache_set(key, response.body)
+    return response
+
+
+async def build_indexes():
+    # Index builds are an optimization: an unreachable database or existing
+    # duplicate SKUs must not stop the app (/test reports the DB)
+    try:
+        # Lets the /stock $lookup resolve movements per item via an index scan
+        await coll("stockmovement").create_index([("item_id", 1), ("type", 1)], background=True)
+    except PyMongoError as e:
+        logger.warning("Could not create stockmovement index: %s", e)
+    try:
+        # Backs the duplicate-SKU lookup in create_item and closes its race
+        await coll("item").create_index("sku", unique=True)
+    except PyMongoError as e:
+        logger.warning("Could not create unique item.sku index: %s", e)
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if db is None:
+        return
+    # Run in the background so an unreachable database (30s server selection
+    # per call) doesn't hold up serving /healthz and /test
+    app.state.index_task = asyncio.create_task(build_indexes())
+
+
 @app.get("/")
-def read_root():
-    return {"message": "Hardware Shop ERP Backend Running"}
+async def read_root():
+    return MongoJSONResponse({"message": "Hardware Shop ERP Backend Running"})
 
 
 @app.get("/schema")
-def get_schema():
+async def get_schema():
     # Return names so the DB viewer can introspect
-    return {
+    return MongoJSONResponse({
         "collections": [
             "item", "vendor", "customer", "purchase", "sale", "payment", "stockmovement"
         ]
-    }
+    })
 
 
 # Master data CRUD: Items, Vendors, Customers
 @app.post("/items")
-def create_item(payload: Item):
-    existing = coll("item").find_one({"sku": payload.sku})
+async def create_item(payload: Item):
+    # Indexed lookup via the unique sku index; it still rejects duplicates if
+    # that index could not be built
+    existing = await coll("item").find_one({"sku": payload.sku}, {"_id": 1})
     if existing:
         raise HTTPException(400, detail="SKU already exists")
-    new_id = create_document("item", payload)
-    return {"id": new_id}
+    try:
+        new_id = await create_document("item", payload)
+    except DuplicateKeyError:
+        # A concurrent request inserted the same SKU after our lookup
+        raise HTTPException(400, detail="SKU already exists")
+    await cache_delete(STOCK_KEY, STOCK_LOW_KEY, ITEMS_KEY)
+    return MongoJSONResponse({"id": new_id})
 
 
 @app.get("/items")
-def list_items():
-    return get_documents("item")
+async def list_items(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return await cached_list_page("item", ITEMS_KEY, limit, after)
 
 
 @app.post("/vendors")
-def create_vendor(payload: Vendor):
-    new_id = create_document("vendor", payload)
-    return {"id": new_id}
+async def create_vendor(payload: Vendor):
+    new_id = await create_document("vendor", payload)
+    await cache_delete(VENDORS_KEY)
+    return MongoJSONResponse({"id": new_id})
 
 
 @app.get("/vendors")
-def list_vendors():
-    return get_documents("vendor")
+async def list_vendors(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return await cached_list_page("vendor", VENDORS_KEY, limit, after)
 
 
 @app.post("/customers")
-def create_customer(payload: Customer):
-    new_id = create_document("customer", payload)
-    return {"id": new_id}
+async def create_customer(payload: Customer):
+    new_id = await create_document("customer", payload)
+    return MongoJSONResponse({"id": new_id})
 
 
 @app.get("/customers")
-def list_customers():
-    return get_documents("customer")
+async def list_customers(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return MongoJSONResponse(await list_page("customer", limit, after))
 
 
 # Purchases: create bill and stock-in movements
 @app.post("/purchases")
-def create_purchase(payload: Purchase):
+async def create_purchase(payload: Purchase):
     # Insert purchase document
-    purchase_id = create_document("purchase", payload)
-
-    # Create stock movements for each item (IN)
-    for line in payload.items:
-        movement = StockMovement(
-            item_id=line.item_id,
-            type="in",
-            qty=line.qty,
-            reason="purchase",
-            ref_type="purchase",
-            ref_id=purchase_id,
-            date=datetime.utcnow(),
-        )
-        create_document("stockmovement", movement)
-    return {"id": purchase_id}
+    purchase_id = await create_document("purchase", payload)
+
+    # Create stock movements for each item (IN) in a single round trip
+    docs = movement_docs(payload.items, "in", "purchase", purchase_id)
+    if docs:
+        await coll("stockmovement").insert_many(docs, ordered=False)
+    await cache_delete(STOCK_KEY, STOCK_LOW_KEY)
+    return MongoJSONResponse({"id": purchase_id})
 
 
 @app.get("/purchases")
-def list_purchases():
-    return get_documents("purchase")
+async def list_purchases(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return MongoJSONResponse(await list_page("purchase", limit, after))
 
 
 # Sales: create invoice and stock-out movements
 @app.post("/sales")
-def create_sale(payload: Sale):
-    sale_id = create_document("sale", payload)
-    for line in payload.items:
-        movement = StockMovement(
-            item_id=line.item_id,
-            type="out",
-            qty=line.qty,
-            reason="sale",
-            ref_type="sale",
-            ref_id=sale_id,
-            date=datetime.utcnow(),
-        )
-        create_document("stockmovement", movement)
-    return {"id": sale_id}
+async def create_sale(payload: Sale):
+    sale_id = await create_document("sale", payload)
+    docs = movement_docs(payload.items, "out", "sale", sale_id)
+    if docs:
+        await coll("stockmovement").insert_many(docs, ordered=False)
+    await cache_delete(STOCK_KEY, STOCK_LOW_KEY)
+    return MongoJSONResponse({"id": sale_id})
+
+
+# Bulk import: decoded and validated by msgspec instead of Pydantic
+MAX_BULK_BODY = 5 * 1024 * 1024
+
+
+@app.post("/sales/bulk")
+async def create_sales_bulk(request: Request):
+    # Read incrementally so an oversized body is rejected before it is buffered
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_BULK_BODY:
+            raise HTTPException(413, detail="Request body too large")
+    try:
+        sales = msgspec.json.decode(bytes(body), type=SaleBatch, strict=False)
+    except msgspec.ValidationError as e:
+        raise HTTPException(422, detail=str(e))
+    except msgspec.DecodeError:
+        raise HTTPException(400, detail="Invalid JSON")
+    if not sales:
+        return MongoJSONResponse({"ids": []})
+
+    sale_ids = await create_documents(
+        "sale", [msgspec.to_builtins(sale, builtin_types=(datetime,)) for sale in sales]
+    )
+    docs = []
+    for sale, sale_id in zip(sales, sale_ids):
+        docs.extend(movement_docs(sale.items, "out", "sale", sale_id))
+    if docs:
+        await coll("stockmovement").insert_many(docs, ordered=False)
+    await cache_delete(STOCK_KEY, STOCK_LOW_KEY)
+    return MongoJSONResponse({"ids": sale_ids})
 
 
 @app.get("/sales")
-def list_sales():
-    return get_documents("sale")
+async def list_sales(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return MongoJSONResponse(await list_page("sale", limit, after))
 
 
 # Payments
 @app.post("/payments")
-def create_payment(payload: Payment):
-    payment_id = create_document("payment", payload)
-    return {"id": payment_id}
+async def create_payment(payload: Payment):
+    payment_id = await create_document("payment", payload)
+    return MongoJSONResponse({"id": payment_id})
+
+
+# Trusted internal producers: plain key checks instead of Payment model validation
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN")
+PAYMENT_REF_TYPES = {"purchase", "sale"}
+
+
+@app.post("/internal/payments")
+async def create_payment_internal(request: Request, x_internal_token: Optional[str] = Header(None)):
+    if not INTERNAL_TOKEN or not x_internal_token or not secrets.compare_digest(
+        x_internal_token.encode(), INTERNAL_TOKEN.encode()
+    ):
+        raise HTTPException(403, detail="Forbidden")
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(400, detail="Invalid JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(422, detail="Expected a JSON object")
+
+    amount = body.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        raise HTTPException(422, detail="amount must be a number greater than 0")
+    ref_type = body.get("ref_type")
+    if ref_type not in PAYMENT_REF_TYPES:
+        raise HTTPException(422, detail="ref_type must be purchase or sale")
+    ref_id = body.get("ref_id")
+    if not isinstance(ref_id, str) or not ref_id:
+        raise HTTPException(422, detail="ref_id is required")
+    date = body.get("date")
+    if date is not None:
+        try:
+            date = datetime.fromisoformat(date)
+        except (TypeError, ValueError):
+            raise HTTPException(422, detail="date must be an ISO 8601 string")
+    method = body.get("method", "cash")
+    if not isinstance(method, str):
+        raise HTTPException(422, detail="method must be a string")
+    notes = body.get("notes")
+    if notes is not None and not isinstance(notes, str):
+        raise HTTPException(422, detail="notes must be a string")
+
+    payment_id = await create_document("payment", {
+        "ref_type": ref_type,
+        "ref_id": ref_id,
+        "amount": float(amount),
+        "method": method,
+        "date": date,
+        "notes": notes,
+    })
+    return MongoJSONResponse({"id": payment_id})
 
 
 @app.get("/payments")
-def list_payments():
-    return get_documents("payment")
+async def list_payments(limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None):
+    return MongoJSONResponse(await list_page("payment", limit, after))
 
 
 # Stock report per item (current qty = openings + ins - outs)
 @app.get("/stock")
-def stock_report():
-    items = list(coll("item").find({}))
-    movements = list(coll("stockmovement").find({}))
-
-    qty_map = {}
-    for it in items:
-        qty_map[str(it.get("_id"))] = float(it.get("opening_stock", 0))
-
-    for m in movements:
-        item_key = str(m.get("item_id")) if isinstance(m.get("item_id"), ObjectId) else m.get("item_id")
-        if not item_key:
-            continue
-        qty_map[item_key] = qty_map.get(item_key, 0)
-        if m.get("type") == "in":
-            qty_map[item_key] += float(m.get("qty", 0))
-        elif m.get("type") == "out":
-            qty_map[item_key] -= float(m.get("qty", 0))
-
-    report = []
-    for it in items:
-        key = str(it.get("_id"))
-        report.append({
-            "item_id": key,
-            "name": it.get("name"),
-            "sku": it.get("sku"),
-            "on_hand": round(qty_map.get(key, 0), 2),
-            "unit": it.get("unit", "pcs"),
-        })
-    return report
+async def stock_report(include: Optional[str] = None):
+    # ?include=low adds items at or below their reorder level, from the same pipeline run
+    include_low = include == "low"
+    cache_key = STOCK_LOW_KEY if include_low else STOCK_KEY
+    cached = await cache_get(cache_key)
+    if cached:
+        return Response(cached, media_type="application/json")
+
+    # Any future $match on items should go before the $lookup
+    pipeline = [
+        # Convert the id to its string form once; the lookup and output both reuse it
+        {"$project": {
+            "item_id": {"$toString": "$_id"},
+            "name": 1,
+            "sku": 1,
+            "unit": 1,
+            "opening_stock": 1,
+            "reorder_level": 1,
+        }},
+        {"$lookup": {
+            "from": "stockmovement",
+            "let": {"iid": "$item_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$item_id", "$$iid"]}}},
+                {"$project": {"_id": 0, "type": 1, "qty": 1}},
+                {"$group": {
+                    "_id": None,
+                    "ins": {"$sum": {"$cond": [{"$eq": ["$type", "in"]}, "$qty", 0]}},
+                    "outs": {"$sum": {"$cond": [{"$eq": ["$type", "out"]}, "$qty", 0]}},
+                }},
+            ],
+            "as": "mv",
+        }},
+        # Shape rows on the server so the cursor can be returned as-is
+        {"$project": {
+            "_id": 0,
+            "item_id": 1,
+            "name": 1,
+            "sku": 1,
+            "on_hand": {"$round": [
+                {"$toDouble": {"$add": [
+                    {"$ifNull": ["$opening_stock", 0]},
+                    {"$subtract": [
+                        {"$ifNull": [{"$first": "$mv.ins"}, 0]},
+                        {"$ifNull": [{"$first": "$mv.outs"}, 0]},
+                    ]},
+                ]}},
+                2,
+            ]},
+            "unit": {"$ifNull": ["$unit", "pcs"]},
+            "reorder_level": 1,
+        }},
+    ]
+    if not include_low:
+        pipeline.append({"$project": {"reorder_level": 0}})
+
+    rows = await coll("item").aggregate(pipeline, batchSize=2000).to_list(length=None)
+    if include_low:
+        # Filtered here rather than with $facet: a $facet result is a single
+        # document capped at 16MB, which a large catalog would exceed. on_hand
+        # is already computed per row, so this is still one pipeline run.
+        low = [
+            r for r in rows
+            if r.get("reorder_level") is not None and r["on_hand"] <= r["reorder_level"]
+        ]
+        response = MongoJSONResponse({"stock": rows, "low": low})
+    else:
+        response = MongoJSONResponse(rows)
+    await cache_set(cache_key, response.body)
+    return response
 
 
 # Health check and DB test
+@app.get("/healthz")
+async def healthz():
+    # Liveness/readiness probe: no database round trip
+    return MongoJSONResponse({"status": "ok"})
+
+
+COLLECTIONS_TTL = 30
+_collections_cache = {"t": float("-inf"), "v": []}
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -193,13 +422,26 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Connected"
-            response["collections"] = db.list_collection_names()
+            now = time.monotonic()
+            if now - _collections_cache["t"] > COLLECTIONS_TTL:
+                _collections_cache["v"] = await db.list_collection_names()
+                _collections_cache["t"] = now
+            response["collections"] = _collections_cache["v"]
     except Exception as e:
         response["database"] = f"⚠️ {str(e)[:80]}"
-    return response
+    return MongoJSONResponse(response)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        # Multiple workers need an import string rather than the app object
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", 2)),
+        access_log=os.getenv("ACCESS_LOG", "1") != "0",
+    )
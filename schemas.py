@@ -10,7 +10,7 @@ parties (vendors/customers), purchases, sales, stock movements and payments.
 """
 
 from __future__ import annotations
-from typing import List, Optional
+from typing import Any, List, Optional
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -100,5 +100,5 @@ class StockMovement(BaseModel):
     qty: float = Field(..., gt=0)
     reason: str = Field(..., description="purchase, sale, opening, adjust, return")
     ref_type: Optional[str] = None
-    ref_id: Optional[str] = None
+    ref_id: Optional[Any] = Field(None, description="ObjectId of the purchase/sale document")
     date: Optional[datetime] = None